@@ -31,6 +31,7 @@ CREATE TABLE IF NOT EXISTS messages (
   ocr_text TEXT,
   processed INTEGER DEFAULT 0,
   gemini_processed INTEGER DEFAULT 0,
+  date_ts INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', date) AS INTEGER)) VIRTUAL,
   UNIQUE(channel_id, message_id)
 );
 
@@ -70,4 +71,6 @@ CREATE TABLE IF NOT EXISTS gemini_analysis_logs (
   success INTEGER DEFAULT 1,
   error_message TEXT,
   created_at TEXT DEFAULT CURRENT_TIMESTAMP
-);
\ No newline at end of file
+);
+
+CREATE INDEX IF NOT EXISTS idx_logs_date ON gemini_analysis_logs(analysis_date);
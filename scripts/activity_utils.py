@@ -7,6 +7,7 @@ Provides on-demand calculation of activity metrics with configurable thresholds.
 import os
 import sqlite3
 import sys
+from functools import lru_cache
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Any, Optional
 from collections import defaultdict
@@ -18,10 +19,13 @@ load_dotenv()
 DB_PATH = os.getenv("SQLITE_DB_PATH", "./data/backfill.sqlite")
 
 
+@lru_cache(maxsize=1)
 def validate_threshold_or_fail(threshold_value: str) -> int:
     """
     Validate ACTIVITY_MESSAGE_THRESHOLD is a positive integer.
     
+    The most recent result is memoized.
+    
     Args:
         threshold_value: String value from environment variable
         
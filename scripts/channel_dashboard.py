@@ -7,7 +7,7 @@ Focuses on participant diversity and engagement metrics with clean date-based na
 import os
 import sys
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -16,7 +16,6 @@ from scripts.activity_utils import (
     validate_threshold_or_fail,
     get_channels_with_activity,
     get_current_day_stats,
-    calculate_engagement_score,
     rank_channels_by_engagement,
     get_daily_totals,
     update_channel_activity_timestamp
@@ -25,21 +24,43 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+REPORT_WRITE_BUFFER = 1024 * 1024  # 1MB
 
-def generate_daily_activity_report() -> str:
+# Per-channel report templates, filled once per ranked channel
+CHANNEL_TEMPLATE = """### #{rank} {username}
+**{title}**
+
+- **Engagement Score**: {engagement_score:.2f}
+- **Messages**: {total_messages:,}
+- **Unique Participants**: {unique_participants:,}
+- **Replies**: {reply_count:,} ({reply_ratio:.1%})
+- **Avg Message Length**: {avg_message_length:.1f} characters
+
+**Top Contributors Today:**
+"""
+CONTRIBUTOR_LINE = "- @{0}: {1} messages\n".format
+
+
+def generate_daily_activity_report(threshold: Optional[int] = None) -> Dict[str, Any]:
     """
     Generate comprehensive daily activity report in markdown format.
     
+    Args:
+        threshold: Validated message threshold; read from
+            ACTIVITY_MESSAGE_THRESHOLD when not given
+    
     Returns:
-        Path to generated report file
+        Dictionary with the report path, daily totals, threshold used and
+        number of channels above the threshold
     """
     # Validate configuration
-    threshold_env = os.getenv("ACTIVITY_MESSAGE_THRESHOLD", "5")
-    threshold = validate_threshold_or_fail(threshold_env)
+    if threshold is None:
+        threshold = validate_threshold_or_fail(os.getenv("ACTIVITY_MESSAGE_THRESHOLD", "5"))
     
     # Get current date for report
-    today = datetime.now()
-    date_str = today.strftime('%Y-%m-%d')
+    now = datetime.now()
+    date_str = now.strftime('%Y-%m-%d')
+    generated_at = now.strftime('%Y-%m-%d %H:%M:%S UTC')
     
     # Ensure reports directory exists
     reports_dir = "data/activity_reports"
@@ -71,13 +92,13 @@ def generate_daily_activity_report() -> str:
     ranked_channels = rank_channels_by_engagement(channel_details)
     
     # Generate markdown report
-    markdown_content = generate_markdown_report(
-        date_str, daily_totals, ranked_channels, threshold
+    markdown_sections = generate_markdown_report(
+        date_str, generated_at, daily_totals, ranked_channels, threshold
     )
     
-    # Write report to file
-    with open(report_path, 'w', encoding='utf-8') as f:
-        f.write(markdown_content)
+    # Write report sections straight to file without joining them first
+    with open(report_path, 'w', encoding='utf-8', buffering=REPORT_WRITE_BUFFER) as f:
+        f.writelines(markdown_sections)
     
     # Update activity timestamps for processed channels
     for channel in active_channels:
@@ -86,30 +107,37 @@ def generate_daily_activity_report() -> str:
     print(f"✅ Report generated: {report_path}")
     print(f"   Active channels processed: {len(active_channels)}")
     
-    return report_path
+    return {
+        'path': report_path,
+        'daily_totals': daily_totals,
+        'threshold': threshold,
+        'active_channels_count': len(active_channels)
+    }
 
 
 def generate_markdown_report(
     date_str: str, 
+    generated_at: str,
     daily_totals: Dict[str, Any], 
     ranked_channels: List[Dict[str, Any]], 
     threshold: int
-) -> str:
+) -> List[str]:
     """
     Generate markdown content for the daily activity report.
     
     Args:
         date_str: Date string (YYYY-MM-DD)
+        generated_at: Report generation time string
         daily_totals: Aggregate statistics for the day
-        ranked_channels: List of channels ranked by engagement
+        ranked_channels: Channels ranked by engagement, with engagement_score set
         threshold: Message threshold used for filtering
         
     Returns:
-        Complete markdown report content
+        Markdown report sections in order; concatenated they form the report
     """
-    report = f"""# Daily Activity Report - {date_str}
+    parts = [f"""# Daily Activity Report - {date_str}
 
-Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}  
+Generated: {generated_at}  
 Minimum Activity Threshold: {threshold} messages
 
 ---
@@ -134,40 +162,27 @@ Minimum Activity Threshold: {threshold} messages
 
 *Engagement Formula: (Unique Participants × 2) + (Total Messages × 1) + (Reply Ratio × 1.5)*
 
-"""
+"""]
 
     if not ranked_channels:
-        report += "No channels met the minimum activity threshold today.\n\n"
+        parts.append("No channels met the minimum activity threshold today.\n\n")
     else:
         for i, channel in enumerate(ranked_channels, 1):
-            engagement_score = calculate_engagement_score(channel)
-            
-            report += f"""### #{i} {channel['username']}
-**{channel['title']}**
-
-- **Engagement Score**: {engagement_score:.2f}
-- **Messages**: {channel['total_messages']:,}
-- **Unique Participants**: {channel['unique_participants']:,}
-- **Replies**: {channel['reply_count']:,} ({channel['reply_ratio']:.1%})
-- **Avg Message Length**: {channel['avg_message_length']:.1f} characters
-
-**Top Contributors Today:**
-"""
+            parts.append(CHANNEL_TEMPLATE.format_map({**channel, 'rank': i}))
             if channel['top_contributors']:
-                for username, msg_count in channel['top_contributors']:
-                    report += f"- @{username}: {msg_count} messages\n"
+                parts.extend(CONTRIBUTOR_LINE(*contributor) for contributor in channel['top_contributors'])
             else:
-                report += "- No identified contributors\n"
+                parts.append("- No identified contributors\n")
             
-            report += "\n"
+            parts.append("\n")
 
     # Add footer with metadata
-    report += f"""---
+    parts.append(f"""---
 
 ## 📋 Report Metadata
 
 - **Report Date**: {date_str}
-- **Generation Time**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}
+- **Generation Time**: {generated_at}
 - **Activity Threshold**: {threshold} messages minimum
 - **Total Channels Analyzed**: {daily_totals['total_channels']}
 - **Channels Meeting Threshold**: {len(ranked_channels)}
@@ -181,9 +196,9 @@ Minimum Activity Threshold: {threshold} messages
 ---
 
 *Generated by SignalSifter Activity Analytics*
-"""
+""")
 
-    return report
+    return parts
 
 
 def main():
@@ -192,21 +207,19 @@ def main():
     print("=" * 50)
     
     try:
-        report_path = generate_daily_activity_report()
+        threshold = validate_threshold_or_fail(os.getenv("ACTIVITY_MESSAGE_THRESHOLD", "5"))
+        report = generate_daily_activity_report(threshold=threshold)
         
         print(f"\n📋 Activity report generated successfully!")
-        print(f"📁 Location: {report_path}")
+        print(f"📁 Location: {report['path']}")
         
         # Show brief summary
-        daily_totals = get_daily_totals()
-        threshold_env = os.getenv("ACTIVITY_MESSAGE_THRESHOLD", "5")
-        threshold = validate_threshold_or_fail(threshold_env)
-        active_channels = get_channels_with_activity(threshold)
+        daily_totals = report['daily_totals']
         
         print(f"\n📊 Quick Summary:")
         print(f"   • Total messages today: {daily_totals['total_messages']:,}")
         print(f"   • Active channels: {daily_totals['active_channels']}")
-        print(f"   • Channels above threshold ({threshold}+): {len(active_channels)}")
+        print(f"   • Channels above threshold ({threshold}+): {report['active_channels_count']}")
         print(f"   • Total participants: {daily_totals['total_participants']:,}")
         
         return True
@@ -6,6 +6,7 @@ Extracts new messages since last export and generates incremental analysis.
 Usage:
   python scripts/daily_gemini_sync.py --channel @Galactic_Mining_Club
   python scripts/daily_gemini_sync.py --channel @Galactic_Mining_Club --force-reprocess
+  python scripts/daily_gemini_sync.py --channels @channel_one,@channel_two
 
 Environment variables (in `.env`):
   GEMINI_API_KEY      # Google AI Studio API key
@@ -21,13 +22,15 @@ Features:
 from __future__ import annotations
 
 import argparse
+import asyncio
+import io
 import os
 import sqlite3
 import sys
-import tempfile
-from datetime import datetime, timedelta
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterable, Iterator, TextIO, Tuple
 
 from dotenv import load_dotenv
 
@@ -38,9 +41,9 @@ sys.path.insert(0, script_dir)
 sys.path.insert(0, project_root)
 
 try:
-    from gemini_analyzer import GeminiAnalyzer
+    from gemini_analyzer import GeminiAnalyzer, save_analysis_result
 except ImportError:
-    from scripts.gemini_analyzer import GeminiAnalyzer
+    from scripts.gemini_analyzer import GeminiAnalyzer, save_analysis_result
 
 load_dotenv()
 
@@ -48,6 +51,15 @@ load_dotenv()
 DB_PATH = os.getenv("SQLITE_DB_PATH", "./data/backfill.sqlite")
 ANALYSIS_OUTPUT_DIR = "./data/gemini_analysis/"
 RAW_MESSAGES_DIR = "./data/"
+UPDATE_CHUNK_SIZE = 500  # Stay well below SQLite's 999 bound-parameter default
+
+# Lightweight record for message rows streamed from the database
+Message = namedtuple('Message', 'id message_id sender_username sender_name date text')
+
+
+def quota_day() -> str:
+    """Today's date in UTC, the day GeminiAnalyzer's daily request limit resets on."""
+    return datetime.now(timezone.utc).date().isoformat()
 
 
 class DailyGeminiSync:
@@ -57,6 +69,32 @@ class DailyGeminiSync:
         self.analyzer = GeminiAnalyzer(gemini_api_key)
         self.analysis_dir = Path(ANALYSIS_OUTPUT_DIR)
         self.analysis_dir.mkdir(parents=True, exist_ok=True)
+        self._log_buffer: List[Tuple] = []
+        self._ensure_indexes()
+    
+    def _ensure_indexes(self):
+        """Create columns and indexes used by the sync queries on databases that predate them."""
+        conn = sqlite3.connect(self.db_path)
+        
+        # WAL is persistent: readers (dashboard, status checks) stop blocking the
+        # sync writers and vice versa
+        conn.execute("PRAGMA journal_mode=WAL")
+        
+        # Integer epoch view of messages.date so range scans compare
+        # fixed-size keys instead of ISO strings (table_xinfo lists generated columns)
+        columns = {row[1] for row in conn.execute("PRAGMA table_xinfo(messages)")}
+        if "date_ts" not in columns:
+            conn.execute("""
+                ALTER TABLE messages ADD COLUMN date_ts INTEGER
+                GENERATED ALWAYS AS (CAST(strftime('%s', date) AS INTEGER)) VIRTUAL
+            """)
+        
+        conn.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_messages_channel_date ON messages(channel_id, date);
+            CREATE INDEX IF NOT EXISTS idx_messages_channel_ts ON messages(channel_id, date_ts);
+            CREATE INDEX IF NOT EXISTS idx_logs_date ON gemini_analysis_logs(analysis_date);
+        """)
+        conn.close()
     
     def get_channel_info(self, channel_identifier: str) -> Optional[Dict[str, Any]]:
         """Get channel information from database."""
@@ -83,8 +121,8 @@ class DailyGeminiSync:
             }
         return None
     
-    def get_new_messages_since(self, channel_id: str, since_date: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Extract new messages since last Gemini export."""
+    def get_new_messages_since(self, channel_id: str, since_date: Optional[str] = None) -> Iterator[Message]:
+        """Stream new messages since last Gemini export, straight from the cursor."""
         conn = sqlite3.connect(self.db_path)
         cur = conn.cursor()
         
@@ -96,48 +134,49 @@ class DailyGeminiSync:
         params = [channel_id]
         
         if since_date:
-            query += " AND date > ?"
-            params.append(since_date)
+            query += " AND date_ts > ?"
+            params.append(int(datetime.fromisoformat(since_date).timestamp()))
         
         # Order by date for chronological processing
-        query += " ORDER BY date ASC"
+        query += " ORDER BY date_ts ASC"
         
-        cur.execute(query, params)
-        rows = cur.fetchall()
-        conn.close()
-        
-        messages = []
-        for row in rows:
-            messages.append({
-                "id": row[0],
-                "message_id": row[1],
-                "sender_username": row[2] or "Unknown",
-                "sender_name": row[3],
-                "date": row[4],
-                "text": row[5]
-            })
-        
-        return messages
+        try:
+            cur.execute(query, params)
+            for row in cur:
+                yield Message(*row)
+        finally:
+            conn.close()
     
-    def format_messages_for_analysis(self, messages: List[Dict[str, Any]]) -> str:
-        """Format messages in the expected timestamp format for Gemini analysis."""
-        formatted_lines = []
+    def format_messages_for_analysis(self, messages: Iterable[Message], out: TextIO) -> int:
+        """
+        Write messages in the expected timestamp format for Gemini analysis.
+        
+        Lines are streamed to ``out`` one at a time instead of being joined
+        into a single in-memory string.
+        
+        Returns:
+            Number of characters written
+        """
+        written = 0
+        separator = ""
+        write = out.write
         
-        for msg in messages:
+        for _id, _message_id, sender_username, sender_name, date, text in messages:
             # Use sender_username if available, otherwise sender_name, otherwise Unknown
-            sender = msg["sender_username"]
-            if not sender or sender == "Unknown":
-                sender = msg["sender_name"] or "Unknown"
+            if sender_username and sender_username != "Unknown":
+                sender = sender_username
+            else:
+                sender = sender_name or "Unknown"
             
             # Ensure sender has @ prefix
-            if sender != "Unknown" and not sender.startswith('@'):
-                sender = f"@{sender}"
+            if sender != "Unknown" and sender[0] != '@':
+                sender = '@' + sender
             
             # Format: [YYYY-MM-DD HH:MM:SS UTC] @username: message_text
-            formatted_line = f"[{msg['date']}] {sender}: {msg['text']}"
-            formatted_lines.append(formatted_line)
+            written += write(f"{separator}[{date}] {sender}: {text}")
+            separator = "\n\n"
         
-        return "\n\n".join(formatted_lines)
+        return written
     
     def update_gemini_export_timestamp(self, channel_id: str, export_timestamp: str):
         """Update last_gemini_export timestamp for channel."""
@@ -158,36 +197,71 @@ class DailyGeminiSync:
         if not message_ids:
             return
             
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")  # safe under WAL, fsyncs only at checkpoints
         cur = conn.cursor()
         
-        placeholders = ','.join('?' * len(message_ids))
-        cur.execute(f"""
-            UPDATE messages 
-            SET gemini_processed = 1 
-            WHERE id IN ({placeholders})
-        """, message_ids)
-        
-        conn.commit()
-        conn.close()
+        # Commit all chunks in one transaction
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            self._mark_processed(cur, message_ids)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
     
-    def log_analysis_session(self, channel_id: str, analysis_result: Dict[str, Any], 
-                           messages_count: int, analysis_file: str, metadata_file: str):
-        """Log analysis session to database."""
-        conn = sqlite3.connect(self.db_path)
+    def _mark_processed(self, cur: sqlite3.Cursor, message_ids: List[int]):
+        """Set gemini_processed on message_ids within the caller's transaction."""
+        # Chunk the IN-list to stay under SQLITE_MAX_VARIABLE_NUMBER
+        for start in range(0, len(message_ids), UPDATE_CHUNK_SIZE):
+            chunk = message_ids[start:start + UPDATE_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            cur.execute(f"""
+                UPDATE messages 
+                SET gemini_processed = 1 
+                WHERE id IN ({placeholders})
+            """, chunk)
+    
+    def commit_channel_sync(self, channel_id: str, export_timestamp: str,
+                            message_ids: List[int], log_row: Tuple):
+        """
+        Record a finished channel sync in one transaction: advance the export
+        timestamp, mark the messages processed and write the session log row.
+        
+        The row (see analysis_log_row) is passed in rather than queued, so a
+        rolled-back or killed sync leaves neither the messages marked nor the
+        session logged, and the two can never disagree.
+        """
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")  # safe under WAL, fsyncs only at checkpoints
         cur = conn.cursor()
         
-        cur.execute("""
-            INSERT INTO gemini_analysis_logs (
-                channel_id, analysis_date, messages_processed, api_requests_used,
-                chunks_processed, analysis_file_path, metadata_file_path,
-                citations_count, analysis_type, success, error_message
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("""
+                UPDATE channels 
+                SET last_gemini_export = ? 
+                WHERE tg_id = ?
+            """, (export_timestamp, channel_id))
+            self._mark_processed(cur, message_ids)
+            self._insert_log_rows(cur, [log_row])
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+    
+    def analysis_log_row(self, channel_id: str, analysis_result: Dict[str, Any], 
+                         messages_count: int, analysis_file: str, metadata_file: str) -> Tuple:
+        """Build the gemini_analysis_logs row for a successful analysis session."""
+        return (
             channel_id,
-            datetime.now().date().isoformat(),
+            quota_day(),
             messages_count,
-            analysis_result.get('chunks_processed', 1),  # API requests ≈ chunks
+            analysis_result.get('api_requests', 0),
             analysis_result.get('chunks_processed', 1),
             analysis_file,
             metadata_file,
@@ -195,12 +269,59 @@ class DailyGeminiSync:
             'comprehensive',
             1 if not analysis_result.get('fallback') else 0,
             None
+        )
+    
+    def log_analysis_session(self, channel_id: str, analysis_result: Dict[str, Any], 
+                           messages_count: int, analysis_file: str, metadata_file: str):
+        """Queue a successful analysis session for logging (see flush_analysis_logs)."""
+        self._log_buffer.append(self.analysis_log_row(
+            channel_id, analysis_result, messages_count, analysis_file, metadata_file
+        ))
+    
+    def log_failed_session(self, channel_id: str, messages_count: int, error: Exception):
+        """Queue a failed analysis session for logging (see flush_analysis_logs)."""
+        self._log_buffer.append((
+            channel_id,
+            quota_day(),
+            messages_count,
+            None, None, None, None, None,
+            'comprehensive',
+            0,
+            str(error)
         ))
+    
+    def flush_analysis_logs(self):
+        """Write all queued analysis sessions to the database in one transaction."""
+        if not self._log_buffer:
+            return
         
-        conn.commit()
-        conn.close()
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")  # safe under WAL, fsyncs only at checkpoints
+        cur = conn.cursor()
+        
+        cur.execute("BEGIN")
+        try:
+            self._insert_log_rows(cur, self._log_buffer)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        
+        self._log_buffer.clear()
+    
+    def _insert_log_rows(self, cur: sqlite3.Cursor, rows: Iterable[Tuple]):
+        """Insert analysis session rows within the caller's transaction."""
+        cur.executemany("""
+            INSERT INTO gemini_analysis_logs (
+                channel_id, analysis_date, messages_processed, api_requests_used,
+                chunks_processed, analysis_file_path, metadata_file_path,
+                citations_count, analysis_type, success, error_message
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
     
-    def sync_channel(self, channel_identifier: str, force_reprocess: bool = False) -> bool:
+    async def sync_channel(self, channel_identifier: str, force_reprocess: bool = False) -> bool:
         """
         Perform daily sync for a specific channel.
         
@@ -233,27 +354,36 @@ class DailyGeminiSync:
         else:
             print("Full processing (no previous export or force reprocess)")
         
-        # Extract new messages
-        messages = self.get_new_messages_since(channel_id, since_date)
+        # Extract, format and collect ids in a single pass over the cursor.
+        # Formatted lines are written straight into one in-memory buffer, so
+        # no per-message list or joined copy is built (and nothing touches disk).
+        message_ids = []
+        
+        def track_ids(rows: Iterable[Message]) -> Iterator[Message]:
+            for msg in rows:
+                message_ids.append(msg.id)
+                yield msg
         
-        if not messages:
+        messages = track_ids(self.get_new_messages_since(channel_id, since_date))
+        buffer = io.StringIO()
+        formatted_chars = self.format_messages_for_analysis(messages, buffer)
+        
+        if not message_ids:
             print("No new messages to process")
             return True
         
-        print(f"Found {len(messages)} messages to analyze")
+        print(f"Found {len(message_ids)} messages to analyze")
         
-        # Format messages for analysis
-        formatted_messages = self.format_messages_for_analysis(messages)
+        # Every formatted line carries a "[date] sender:" prefix, so having
+        # message ids already guarantees non-empty content
+        formatted_messages = buffer.getvalue()
+        buffer.close()
         
-        if not formatted_messages.strip():
-            print("No valid message content found")
-            return True
-        
-        print(f"Formatted {len(formatted_messages)} characters for analysis")
+        print(f"Formatted {formatted_chars} characters for analysis")
         
         try:
             # Perform Gemini analysis
-            analysis_result = self.analyzer.analyze_messages(formatted_messages, "comprehensive")
+            analysis_result = await self.analyzer.analyze_messages(formatted_messages, "comprehensive")
             
             # Save analysis results
             timestamp = datetime.now().strftime("%Y-%m-%d_%H%M%S")
@@ -261,30 +391,20 @@ class DailyGeminiSync:
             metadata_file = self.analysis_dir / f"{channel_name}_daily_metadata_{timestamp}.json"
             
             # Save using gemini_analyzer's save function
-            try:
-                from gemini_analyzer import save_analysis_result
-            except ImportError:
-                from scripts.gemini_analyzer import save_analysis_result
             save_analysis_result(analysis_result, str(self.analysis_dir), f"{channel_name}_daily")
             
-            # Update database records
-            current_timestamp = datetime.now().isoformat()
-            self.update_gemini_export_timestamp(channel_id, current_timestamp)
-            
-            # Mark messages as processed
-            message_ids = [msg["id"] for msg in messages]
-            self.mark_messages_as_gemini_processed(message_ids)
-            
-            # Log session
-            self.log_analysis_session(
-                channel_id, analysis_result, len(messages), 
+            # Update database records and log the session in one transaction
+            log_row = self.analysis_log_row(
+                channel_id, analysis_result, len(message_ids), 
                 str(analysis_file), str(metadata_file)
             )
+            current_timestamp = datetime.now().isoformat()
+            self.commit_channel_sync(channel_id, current_timestamp, message_ids, log_row)
             
             print(f"✅ Daily sync completed successfully!")
-            print(f"   Processed: {len(messages)} messages")
+            print(f"   Processed: {len(message_ids)} messages")
             print(f"   Citations: {len(analysis_result.get('citations', []))}")
-            print(f"   API requests: {analysis_result.get('chunks_processed', 1)}")
+            print(f"   API requests: {analysis_result.get('api_requests', 0)}")
             
             return True
             
@@ -292,25 +412,17 @@ class DailyGeminiSync:
             print(f"❌ Analysis failed: {e}")
             
             # Log failed session
-            conn = sqlite3.connect(self.db_path)
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO gemini_analysis_logs (
-                    channel_id, analysis_date, messages_processed, 
-                    success, error_message
-                ) VALUES (?, ?, ?, ?, ?)
-            """, (
-                channel_id, datetime.now().date().isoformat(), 
-                len(messages), 0, str(e)
-            ))
-            conn.commit()
-            conn.close()
+            self.log_failed_session(channel_id, len(message_ids), e)
+            self.flush_analysis_logs()
             
             return False
     
     def get_daily_usage_stats(self) -> Dict[str, Any]:
         """Get today's API usage statistics."""
-        today = datetime.now().date().isoformat()
+        # Include sessions still waiting in the log buffer
+        self.flush_analysis_logs()
+        
+        today = quota_day()
         
         conn = sqlite3.connect(self.db_path)
         cur = conn.cursor()
@@ -341,6 +453,7 @@ class DailyGeminiSync:
 def main():
     parser = argparse.ArgumentParser(description="Daily Gemini sync for Telegram channels")
     parser.add_argument("--channel", help="Channel username or ID (e.g., @Galactic_Mining_Club)")
+    parser.add_argument("--channels", help="Comma-separated channels to sync concurrently")
     parser.add_argument("--force-reprocess", action="store_true", 
                        help="Reprocess all messages ignoring last export date")
     parser.add_argument("--stats", action="store_true", 
@@ -355,8 +468,12 @@ def main():
         return run_off_peak_analytics()
     
     # Require channel for normal Gemini sync
-    if not args.channel:
-        print("❌ --channel is required for Gemini sync mode")
+    channels = [c.strip() for c in (args.channels or "").split(",") if c.strip()]
+    if args.channel:
+        channels.insert(0, args.channel)
+    channels = list(dict.fromkeys(channels))  # drop repeats, keep order
+    if not channels:
+        print("❌ --channel or --channels is required for Gemini sync mode")
         parser.print_help()
         return 1
     
@@ -389,8 +506,21 @@ def main():
     
     print(f"📊 API requests available today: {stats['api_requests_remaining']}/50")
     
-    # Perform sync
-    success = sync.sync_channel(args.channel, args.force_reprocess)
+    # Start the analyzer's daily counter from today's logged usage so this run
+    # can only spend what is left of the budget, however many channels it syncs
+    sync.analyzer.daily_requests = stats['total_api_requests']
+    
+    # Perform sync; all channels share one event loop so the analyzer's
+    # client and rate limiter are only ever used from that loop
+    async def sync_all() -> List[bool]:
+        return await asyncio.gather(
+            *(sync.sync_channel(channel, args.force_reprocess) for channel in channels)
+        )
+    
+    try:
+        success = all(asyncio.run(sync_all()))
+    finally:
+        sync.flush_analysis_logs()
     
     return 0 if success else 1
 
@@ -410,10 +540,10 @@ def run_off_peak_analytics() -> int:
         from channel_dashboard import generate_daily_activity_report
         
         # Generate activity report
-        report_path = generate_daily_activity_report()
+        report = generate_daily_activity_report()
         
         print(f"✅ Off-peak analytics completed successfully!")
-        print(f"📁 Activity report: {report_path}")
+        print(f"📁 Activity report: {report['path']}")
         
         return 0
         
@@ -23,19 +23,20 @@ from __future__ import annotations
 
 import argparse
 import asyncio
-import json
+import hashlib
 import os
 import sqlite3
+import sys
 import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
 import re
 from collections import Counter, defaultdict
 
-import google.generativeai as genai
+import orjson
 from dotenv import load_dotenv
-from ratelimit import limits, sleep_and_retry
-import requests
 
 
 load_dotenv()
@@ -43,131 +44,24 @@ load_dotenv()
 # Rate limiting configuration for free tier
 REQUESTS_PER_MINUTE = 2
 REQUESTS_PER_DAY = 50
+# The bucket holds a single token refilled every 60/RPM seconds plus this margin,
+# so no 60s window can ever contain more than REQUESTS_PER_MINUTE requests
+RATE_LIMIT_BUFFER_SECONDS = 1
 MAX_TOKENS_PER_REQUEST = 2000000  # 2M context window
 
 # Database configuration
 DB_PATH = os.getenv("SQLITE_DB_PATH", "./data/backfill.sqlite")
 
+# Citation format: [YYYY-MM-DD HH:MM:SS UTC] @username
+RE_CITATION = re.compile(r'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} UTC)\] @(\w+)')
 
-class GeminiAnalyzer:
-    def __init__(self, api_key: str):
-        """Initialize Gemini analyzer with rate limiting."""
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY is required")
-        
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-pro-latest')
-        
-        # Rate limiting state
-        self.daily_requests = 0
-        self.last_request_day = datetime.now().date()
-        self.request_times = []
-        
-    def _check_daily_limit(self) -> bool:
-        """Check if daily request limit has been exceeded."""
-        current_date = datetime.now().date()
-        
-        # Reset daily counter if new day
-        if current_date != self.last_request_day:
-            self.daily_requests = 0
-            self.last_request_day = current_date
-            
-        return self.daily_requests < REQUESTS_PER_DAY
-    
-    def _enforce_rate_limit(self):
-        """Enforce rate limiting: max 2 requests per minute."""
-        now = time.time()
-        
-        # Remove requests older than 1 minute
-        self.request_times = [t for t in self.request_times if now - t < 60]
-        
-        # If we've made 2 requests in the last minute, wait
-        if len(self.request_times) >= REQUESTS_PER_MINUTE:
-            sleep_time = 60 - (now - self.request_times[0]) + 1  # +1 second buffer
-            if sleep_time > 0:
-                print(f"Rate limiting: waiting {sleep_time:.1f} seconds...")
-                time.sleep(sleep_time)
-        
-        # Record this request
-        self.request_times.append(now)
-        self.daily_requests += 1
-    
-    def _estimate_tokens(self, text: str) -> int:
-        """Rough token estimation (4 chars = ~1 token)."""
-        return len(text) // 4
-    
-    def _chunk_messages(self, messages: str, max_tokens: int = 1800000) -> List[str]:
-        """Split messages into chunks that fit within token limits (with buffer)."""
-        lines = messages.split('\n')
-        chunks = []
-        current_chunk = []
-        current_tokens = 0
-        
-        for line in lines:
-            line_tokens = self._estimate_tokens(line)
-            
-            if current_tokens + line_tokens > max_tokens and current_chunk:
-                # Save current chunk and start new one
-                chunks.append('\n'.join(current_chunk))
-                current_chunk = [line]
-                current_tokens = line_tokens
-            else:
-                current_chunk.append(line)
-                current_tokens += line_tokens
-        
-        # Add final chunk
-        if current_chunk:
-            chunks.append('\n'.join(current_chunk))
-            
-        return chunks
-    
-    def analyze_messages(self, messages_text: str, analysis_type: str = "comprehensive") -> Dict[str, Any]:
-        """
-        Analyze Telegram messages using Gemini API with NotebookLM-style insights.
-        
-        Args:
-            messages_text: Raw message text in format [timestamp] @user: message
-            analysis_type: Type of analysis (comprehensive, summary, entities)
-            
-        Returns:
-            Dictionary containing analysis results with citations
-        """
-        if not self._check_daily_limit():
-            raise Exception(f"Daily API limit ({REQUESTS_PER_DAY}) exceeded")
-        
-        # Chunk messages if too large
-        chunks = self._chunk_messages(messages_text)
-        
-        if len(chunks) > 1:
-            print(f"Processing {len(chunks)} chunks due to size...")
-        
-        all_results = []
-        
-        for i, chunk in enumerate(chunks, 1):
-            print(f"Analyzing chunk {i}/{len(chunks)}...")
-            
-            self._enforce_rate_limit()
-            
-            prompt = self._build_analysis_prompt(chunk, analysis_type)
-            
-            try:
-                response = self.model.generate_content(prompt)
-                result = self._parse_response(response.text, chunk_id=i)
-                all_results.append(result)
-                
-            except Exception as e:
-                print(f"API error on chunk {i}: {e}")
-                # Fallback analysis
-                result = self._fallback_analysis(chunk, chunk_id=i)
-                all_results.append(result)
-        
-        # Combine results from all chunks
-        return self._combine_chunk_results(all_results, messages_text)
-    
-    def _build_analysis_prompt(self, messages: str, analysis_type: str) -> str:
-        """Build structured prompt for crypto community analysis."""
-        
-        base_prompt = """You are an expert cryptocurrency community analyst. Analyze the following Telegram channel messages and provide comprehensive insights similar to NotebookLM's deep analysis capabilities.
+# Fallback analysis patterns
+RE_USER = re.compile(r'@(\w+):')
+RE_CRYPTO = re.compile(r'\b(?:BTC|ETH|LUNA|OSMO|ATOM|NFT|DeFi)\b|\$[A-Z]{2,6}', re.IGNORECASE)
+RE_NONEMPTY_LINE = re.compile(r'^[ \t\r\f\v]*\S', re.MULTILINE)
+
+# Analysis prompt pieces; the messages go between them
+ANALYSIS_BASE_PROMPT = """You are an expert cryptocurrency community analyst. Analyze the following Telegram channel messages and provide comprehensive insights similar to NotebookLM's deep analysis capabilities.
 
 The messages are in format: [YYYY-MM-DD HH:MM:SS UTC] @username: message_content
 
@@ -186,8 +80,8 @@ CRITICAL: Use this exact citation format: [2025-12-07 17:20:13 UTC] @username
 
 Messages to analyze:
 """
-        
-        comprehensive_instructions = """
+
+COMPREHENSIVE_INSTRUCTIONS = """
 Provide a detailed analysis report with:
 
 ## Executive Summary
@@ -234,64 +128,301 @@ List 5-10 most significant messages with full citations
 *Include citations for each point*
 
 """
+
+
+@dataclass(slots=True, frozen=True)
+class Citation:
+    """A `[timestamp] @username` reference found in an analysis."""
+    timestamp: str
+    username: str
+    
+    @property
+    def full_citation(self) -> str:
+        return f"[{self.timestamp}] @{self.username}"
+
+
+class GeminiAnalyzer:
+    def __init__(self, api_key: str):
+        """Initialize Gemini analyzer with rate limiting."""
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY is required")
+        
+        # Imported here so `--help` and importers like daily_gemini_sync start fast
+        import google.generativeai as genai
+        
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel('gemini-1.5-pro-latest')
+        
+        # Token bucket of capacity 1, refilled continuously. A larger capacity
+        # would let a full burst plus one refill land inside the same minute.
+        # Measured on the event loop clock (monotonic), same as asyncio.sleep
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
         
+        # Rate limiting state. The UTC day is derived from the monotonic clock
+        # plus this offset, so one clock read serves both limits
+        self._wall_offset = time.time() - self.last_refill
+        self.daily_requests = 0
+        self.last_request_day = self._utc_day(self.last_refill)
+        
+        # Shared by every analyze_messages call on this analyzer; asyncio
+        # primitives bind to the running loop on first use, so these must
+        # only be used from a single event loop
+        self._rate_limit_lock = asyncio.Lock()
+        self._request_semaphore = asyncio.Semaphore(REQUESTS_PER_MINUTE)
+        
+        self._init_response_cache()
+    
+    def _init_response_cache(self):
+        """Create the on-disk response cache table if needed."""
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS gemini_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT,
+                citations BLOB,
+                ts INTEGER
+            )
+        """)
+        
+        # Caches created before citations were stored alongside the response
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(gemini_cache)")}
+        if "citations" not in columns:
+            conn.execute("ALTER TABLE gemini_cache ADD COLUMN citations BLOB")
+        conn.commit()
+        conn.close()
+    
+    async def _cached_generate(self, prompt: str, analysis_type: str,
+                               usage: Counter) -> Tuple[str, List[Citation]]:
+        """
+        Generate a response for prompt, reusing a cached response when the same
+        model, analysis type and prompt were seen before.
+        
+        Cache hits skip rate limiting and do not count against the daily quota;
+        every request actually reserved is counted in usage["api_requests"].
+        The response's citations are cached in the same row, so a hit also
+        skips the citation scan.
+        
+        Returns:
+            Tuple of (response text, citations)
+        """
+        key = hashlib.sha256(
+            f"{self.model.model_name}|{analysis_type}|{prompt}".encode('utf-8')
+        ).hexdigest()
+        
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            row = conn.execute(
+                "SELECT response, citations FROM gemini_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                print("Using cached response")
+                response_text, cached_citations = row
+                if cached_citations is None:
+                    # Cached before citations were stored
+                    return response_text, self._extract_citations(response_text)
+                return response_text, [
+                    Citation(timestamp, sys.intern(username))
+                    for timestamp, username in orjson.loads(cached_citations)
+                ]
+            
+            await self._acquire()
+            usage["api_requests"] += 1
+            response = await self.model.generate_content_async(prompt)
+            response_text = response.text
+            citations = self._extract_citations(response_text)
+            
+            conn.execute(
+                "INSERT OR REPLACE INTO gemini_cache (key, response, citations, ts) VALUES (?, ?, ?, ?)",
+                (key, response_text,
+                 orjson.dumps([(c.timestamp, c.username) for c in citations]),
+                 int(time.time()))
+            )
+            conn.commit()
+            return response_text, citations
+        finally:
+            conn.close()
+        
+    def _utc_day(self, now: float) -> int:
+        """Days since the epoch (UTC) for a monotonic timestamp."""
+        return int((now + self._wall_offset) // 86400)
+    
+    def _check_daily_limit(self, now: float) -> bool:
+        """Check if daily request limit has been exceeded."""
+        current_day = self._utc_day(now)
+        
+        # Reset daily counter if new day
+        if current_day != self.last_request_day:
+            self.daily_requests = 0
+            self.last_request_day = current_day
+            
+        return self.daily_requests < REQUESTS_PER_DAY
+    
+    async def _acquire(self):
+        """
+        Reserve one request against both limits: the daily quota and a token
+        bucket spacing requests so at most 2 fall in any minute.
+        
+        Raises:
+            Exception: If the daily quota is exhausted
+        """
+        # Serialize bucket updates so concurrent chunks cannot overdraw it
+        async with self._rate_limit_lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if not self._check_daily_limit(now):
+                raise Exception(f"Daily API limit ({REQUESTS_PER_DAY}) exceeded")
+            
+            refill_rate = REQUESTS_PER_MINUTE / (60 + RATE_LIMIT_BUFFER_SECONDS)  # tokens per second
+            
+            self.tokens = min(1.0, self.tokens + (now - self.last_refill) * refill_rate)
+            self.last_refill = now
+            
+            if self.tokens < 1:
+                # Wait only as long as it takes to refill the missing fraction of a token
+                sleep_time = (1 - self.tokens) / refill_rate
+                print(f"Rate limiting: waiting {sleep_time:.1f} seconds...")
+                await asyncio.sleep(sleep_time)
+                self.last_refill = loop.time()
+                self.tokens = 0
+            else:
+                self.tokens -= 1
+            
+            self.daily_requests += 1
+    
+    def _estimate_tokens(self, text: str) -> int:
+        """Rough token estimation (4 chars = ~1 token)."""
+        return len(text) // 4
+    
+    def _chunk_messages(self, messages: str, max_tokens: int = 1800000) -> List[str]:
+        """
+        Split messages into chunks that fit within token limits (with buffer).
+        
+        Walks line boundaries with str.find and slices each chunk straight out
+        of the source text, so no per-line list is built.
+        """
+        max_chars = max_tokens * 4  # inverse of _estimate_tokens
+        chunks = []
+        end = len(messages)
+        start = 0  # start of the current chunk
+        pos = 0    # start of the current line
+        
+        while True:
+            newline = messages.find('\n', pos)
+            if newline < 0:
+                newline = end
+            
+            # Close the current chunk before this line if the line would overflow it
+            if newline - start > max_chars and pos > start:
+                chunks.append(messages[start:pos - 1])
+                start = pos
+            
+            if newline == end:
+                break
+            pos = newline + 1
+        
+        # Add final chunk
+        chunks.append(messages[start:end])
+        
+        return chunks
+    
+    async def analyze_messages(self, messages_text: str, analysis_type: str = "comprehensive") -> Dict[str, Any]:
+        """
+        Analyze Telegram messages using Gemini API with NotebookLM-style insights.
+        
+        Chunks are sent concurrently; the token bucket keeps them within the
+        per-minute quota.
+        
+        Args:
+            messages_text: Raw message text in format [timestamp] @user: message
+            analysis_type: Type of analysis (comprehensive, summary, entities)
+            
+        Returns:
+            Dictionary containing analysis results with citations
+        """
+        if not self._check_daily_limit(asyncio.get_running_loop().time()):
+            raise Exception(f"Daily API limit ({REQUESTS_PER_DAY}) exceeded")
+        
+        # Chunk messages if too large
+        chunks = self._chunk_messages(messages_text)
+        
+        if len(chunks) > 1:
+            print(f"Processing {len(chunks)} chunks due to size...")
+        
+        # One wall-clock read stamps every chunk result
+        analyzed_at = datetime.now().isoformat()
+        usage = Counter()
+        
+        async def analyze_chunk(i: int, chunk: str) -> Dict[str, Any]:
+            async with self._request_semaphore:
+                print(f"Analyzing chunk {i}/{len(chunks)}...")
+                
+                prompt = self._build_analysis_prompt(chunk, analysis_type)
+                
+                try:
+                    response_text, citations = await self._cached_generate(prompt, analysis_type, usage)
+                    return self._parse_response(response_text, citations, chunk_id=i, timestamp=analyzed_at)
+                    
+                except Exception as e:
+                    print(f"API error on chunk {i}: {e}")
+                    # Fallback analysis
+                    return self._fallback_analysis(chunk, chunk_id=i, timestamp=analyzed_at)
+        
+        # Identical chunks (e.g. repeated pinned messages) are analyzed once
+        order = []
+        unique_chunks = {}
+        for i, chunk in enumerate(chunks, 1):
+            digest = hashlib.blake2b(chunk.encode('utf-8'), digest_size=16).digest()
+            order.append(digest)
+            unique_chunks.setdefault(digest, (i, chunk))
+        
+        if len(unique_chunks) < len(chunks):
+            print(f"Skipping {len(chunks) - len(unique_chunks)} duplicate chunk(s)")
+        
+        unique_results = await asyncio.gather(
+            *(analyze_chunk(i, chunk) for i, chunk in unique_chunks.values())
+        )
+        results_by_hash = dict(zip(unique_chunks, unique_results))
+        all_results = [results_by_hash[digest] for digest in order]
+        
+        # Combine results from all chunks
+        result = self._combine_chunk_results(all_results, messages_text)
+        result["api_requests"] = usage["api_requests"]
+        return result
+    
+    def _build_analysis_prompt(self, messages: str, analysis_type: str) -> str:
+        """Build structured prompt for crypto community analysis."""
         if analysis_type == "comprehensive":
-            return base_prompt + messages + "\n" + comprehensive_instructions
+            return f"{ANALYSIS_BASE_PROMPT}{messages}\n{COMPREHENSIVE_INSTRUCTIONS}"
         else:
-            return base_prompt + messages + "\n\nProvide a focused analysis based on the specified type."
+            return f"{ANALYSIS_BASE_PROMPT}{messages}\n\nProvide a focused analysis based on the specified type."
     
-    def _parse_response(self, response_text: str, chunk_id: int) -> Dict[str, Any]:
+    def _parse_response(self, response_text: str, citations: List[Citation],
+                        chunk_id: int, timestamp: str) -> Dict[str, Any]:
         """Parse Gemini response into structured format."""
         return {
             "chunk_id": chunk_id,
             "analysis": response_text,
-            "timestamp": datetime.now().isoformat(),
-            "citations": self._extract_citations(response_text)
+            "timestamp": timestamp,
+            "citations": citations
         }
     
-    def _extract_citations(self, text: str) -> List[Dict[str, str]]:
+    def _extract_citations(self, text: str) -> List[Citation]:
         """Extract citation references from analysis text."""
-        # Pattern: [YYYY-MM-DD HH:MM:SS UTC] @username
-        citation_pattern = r'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} UTC)\] @(\w+)'
-        citations = []
-        
-        for match in re.finditer(citation_pattern, text):
-            citations.append({
-                "timestamp": match.group(1),
-                "username": match.group(2),
-                "full_citation": match.group(0)
-            })
-        
-        return citations
+        return [Citation(timestamp, sys.intern(username)) for timestamp, username in RE_CITATION.findall(text)]
     
-    def _fallback_analysis(self, messages: str, chunk_id: int) -> Dict[str, Any]:
+    def _fallback_analysis(self, messages: str, chunk_id: int, timestamp: str) -> Dict[str, Any]:
         """Provide basic analysis when API fails."""
-        lines = messages.split('\n')
-        usernames = []
-        cryptocurrencies = []
-        
-        crypto_keywords = ['BTC', 'ETH', 'LUNA', 'OSMO', 'ATOM', 'NFT', 'DeFi', '$']
-        
-        for line in lines:
-            if '@' in line and ':' in line:
-                try:
-                    username = line.split('@')[1].split(':')[0]
-                    usernames.append(username)
-                except:
-                    pass
-                    
-            # Simple crypto detection
-            for keyword in crypto_keywords:
-                if keyword in line.upper():
-                    cryptocurrencies.append(keyword)
-        
-        user_counts = Counter(usernames)
-        crypto_counts = Counter(cryptocurrencies)
+        # Single regex pass over the whole text for each pattern
+        user_counts = Counter(RE_USER.findall(messages))
+        crypto_counts = Counter(match.upper() for match in RE_CRYPTO.findall(messages))
+        message_count = len(RE_NONEMPTY_LINE.findall(messages))
         
         analysis = f"""## Fallback Analysis (API Unavailable) - Chunk {chunk_id}
 
 ### Activity Summary
-- Total messages analyzed: {len([l for l in lines if l.strip()])}
+- Total messages analyzed: {message_count}
 - Active users: {len(user_counts)}
 - Crypto mentions: {len(crypto_counts)}
 
@@ -308,7 +439,7 @@ This is a simplified analysis due to API limitations. Key message patterns detec
         return {
             "chunk_id": chunk_id,
             "analysis": analysis,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": timestamp,
             "citations": [],
             "fallback": True
         }
@@ -318,27 +449,30 @@ This is a simplified analysis due to API limitations. Key message patterns detec
         if len(results) == 1:
             return results[0]
         
-        combined_analysis = "# Combined Analysis Report\n\n"
-        combined_analysis += f"*Analyzed {len(results)} chunks due to message volume*\n\n"
+        parts = [
+            "# Combined Analysis Report\n\n",
+            f"*Analyzed {len(results)} chunks due to message volume*\n\n",
+        ]
         
         all_citations = []
         
         for i, result in enumerate(results, 1):
-            combined_analysis += f"## Chunk {i} Analysis\n\n"
-            combined_analysis += result["analysis"]
-            combined_analysis += "\n\n---\n\n"
+            parts.append(f"## Chunk {i} Analysis\n\n")
+            parts.append(result["analysis"])
+            parts.append("\n\n---\n\n")
             all_citations.extend(result.get("citations", []))
         
         # Add overall summary
-        combined_analysis += "## Overall Summary\n\n"
-        combined_analysis += "This analysis covers multiple message segments. Key themes and insights have been extracted from each chunk above.\n"
+        parts.append("## Overall Summary\n\n")
+        parts.append("This analysis covers multiple message segments. Key themes and insights have been extracted from each chunk above.\n")
+        combined_analysis = "".join(parts)
         
         return {
             "analysis": combined_analysis,
             "timestamp": datetime.now().isoformat(),
             "citations": all_citations,
             "chunks_processed": len(results),
-            "total_messages": len(original_messages.split('\n')),
+            "total_messages": original_messages.count('\n') + 1,
             "combined": True
         }
 
@@ -360,22 +494,20 @@ def save_analysis_result(result: Dict[str, Any], output_dir: str, channel_name:
     
     # Save full analysis
     analysis_file = os.path.join(output_dir, f"{channel_name}_gemini_analysis_{timestamp}.md")
-    with open(analysis_file, 'w', encoding='utf-8') as f:
-        f.write(f"# Gemini Analysis: {channel_name}\n")
-        f.write(f"Generated: {result['timestamp']}\n\n")
-        f.write(result['analysis'])
+    body = f"# Gemini Analysis: {channel_name}\nGenerated: {result['timestamp']}\n\n{result['analysis']}"
+    Path(analysis_file).write_bytes(body.encode('utf-8'))
     
     # Save metadata
     metadata_file = os.path.join(output_dir, f"{channel_name}_gemini_metadata_{timestamp}.json")
-    with open(metadata_file, 'w', encoding='utf-8') as f:
-        json.dump({
-            "timestamp": result['timestamp'],
-            "citations_count": len(result.get('citations', [])),
-            "chunks_processed": result.get('chunks_processed', 1),
-            "total_messages": result.get('total_messages', 0),
-            "combined": result.get('combined', False),
-            "fallback": result.get('fallback', False)
-        }, f, indent=2)
+    Path(metadata_file).write_bytes(orjson.dumps({
+        "timestamp": result['timestamp'],
+        "citations_count": len(result.get('citations', [])),
+        "chunks_processed": result.get('chunks_processed', 1),
+        "api_requests": result.get('api_requests', 0),
+        "total_messages": result.get('total_messages', 0),
+        "combined": result.get('combined', False),
+        "fallback": result.get('fallback', False)
+    }, option=orjson.OPT_INDENT_2))
     
     print(f"Analysis saved to: {analysis_file}")
     print(f"Metadata saved to: {metadata_file}")
@@ -404,7 +536,7 @@ def main():
     if not messages_text.strip():
         raise SystemExit("No messages found in file")
     
-    print(f"Loaded {len(messages_text)} characters from {len(messages_text.split('\\n'))} lines")
+    print(f"Loaded {len(messages_text)} characters from {messages_text.count(chr(10)) + 1} lines")
     
     # Initialize analyzer
     analyzer = GeminiAnalyzer(api_key)
@@ -412,7 +544,7 @@ def main():
     # Perform analysis
     print(f"Starting {args.analysis_type} analysis...")
     try:
-        result = analyzer.analyze_messages(messages_text, args.analysis_type)
+        result = asyncio.run(analyzer.analyze_messages(messages_text, args.analysis_type))
         
         # Save results
         save_analysis_result(result, args.out, args.channel)
@@ -3,12 +3,14 @@
 
 Usage:
   python scripts/summarize_telegram.py --channel my_channel_username --limit 200
+  python scripts/summarize_telegram.py --channel my_channel_username --local   # needs transformers + torch
 
 Environment variables (in `.env`):
   TELEGRAM_API_ID
   TELEGRAM_API_HASH
-  HF_TOKEN            # Hugging Face token with read/inference scope
+  HF_TOKEN            # Hugging Face token with read/inference scope (not needed with --local)
   HF_MODEL (opt)      # model id, e.g. 'facebook/bart-large-cnn'
+  HF_CACHE_PATH (opt) # summary cache, defaults to ~/.cache/signalsifter/hf_cache.sqlite
 
 Notes:
   - On first run Telethon may prompt for login (phone/code) to create a session file.
@@ -19,20 +21,80 @@ from __future__ import annotations
 
 import argparse
 import asyncio
+import hashlib
 import math
 import os
+import re
+import sqlite3
 import textwrap
-from typing import List
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional
 
-import requests
+import orjson
+import zstandard as zstd
 from dotenv import load_dotenv
-from telethon import TelegramClient
+
+if TYPE_CHECKING:
+    from telethon import TelegramClient
 
 
 load_dotenv()
 
+# Successful HF responses are cached here across runs, keyed by model and inputs
+CACHE_DB_PATH = os.getenv("HF_CACHE_PATH", os.path.expanduser("~/.cache/signalsifter/hf_cache.sqlite"))
+
+# A sentence is a run of 16+ chars between periods/newlines, trimmed of surrounding whitespace
+RE_SENTENCE = re.compile(r'[^.\s][^.\n]{14,}[^.\s]')
+
+# Lines that start with a URL contribute no sentences
+RE_URL_LINE = re.compile(r'[ \t]*http')
+
+# Cached summaries and `.zst` outputs are zstd-compressed at this level. zstd
+# contexts must not be shared between threads and the cache is used from
+# to_thread workers, so only the single-threaded `.zst` write uses _ZSTD_C
+ZSTD_LEVEL = 3
+_ZSTD_C = zstd.ZstdCompressor(level=ZSTD_LEVEL)
+
+# Telegram returns at most this many messages per history request
+HISTORY_PAGE_SIZE = 100
+
+# A paragraph is a run of non-empty lines; chunks are packed from whole paragraphs
+RE_PARAGRAPH = re.compile(r'[^\n]+(?:\n(?!\n)[^\n]+)*')
+
+# Hugging Face inference endpoints, tried in order for per-item calls
+HF_ENDPOINTS = (
+    "https://api-inference.huggingface.co/models/{model}",
+    "https://router.huggingface.co/models/{model}",
+)
+
+# Shared keep-alive session so chunk requests and endpoint fallbacks reuse TLS connections.
+# Created on first use by _hf_session()
+_HF_SESSION = None
+
 
 def chunk_text(text: str, max_chars: int = 3000) -> List[str]:
+    """Greedily pack paragraphs into chunks of at most max_chars."""
+    chunks = []
+    start = end = None  # span of the chunk being built
+    for m in RE_PARAGRAPH.finditer(text):
+        p_start, p_end = m.span()
+        if start is not None and p_end - start > max_chars:
+            chunks.append(text[start:end])
+            start = None
+        if p_end - p_start > max_chars:
+            chunks.extend(_cut_at_boundaries(text[p_start:p_end], max_chars))
+            continue
+        if start is None:
+            start = p_start
+        end = p_end
+    if start is not None:
+        chunks.append(text[start:end])
+    return [c for c in chunks if not c.isspace()]
+
+
+def _cut_at_boundaries(text: str, max_chars: int) -> List[str]:
+    # only used for a single paragraph longer than max_chars
     chunks = []
     start = 0
     while start < len(text):
@@ -49,31 +111,98 @@ def chunk_text(text: str, max_chars: int = 3000) -> List[str]:
     return [c for c in chunks if c]
 
 
+def _hf_cache_key(model: str, inputs: str) -> str:
+    return hashlib.blake2b(f"{model}\n{inputs}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _hf_cache_connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(CACHE_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(CACHE_DB_PATH)
+    conn.execute("CREATE TABLE IF NOT EXISTS hf_cache (key TEXT PRIMARY KEY, summary BLOB, ts INTEGER)")
+    return conn
+
+
+def _hf_cache_get(key: str) -> Optional[str]:
+    conn = _hf_cache_connect()
+    try:
+        row = conn.execute("SELECT summary FROM hf_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        # rows written before compression was added are plain text
+        summary = row[0]
+        return zstd.ZstdDecompressor().decompress(summary).decode("utf-8") if isinstance(summary, bytes) else summary
+    finally:
+        conn.close()
+
+
+def _hf_cache_put(key: str, summary: str) -> None:
+    conn = _hf_cache_connect()
+    try:
+        conn.execute("INSERT OR REPLACE INTO hf_cache (key, summary, ts) VALUES (?, ?, ?)",
+                     (key, zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(summary.encode("utf-8")), int(time.time())))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _hf_session():
+    global _HF_SESSION
+    if _HF_SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504],
+                              allowed_methods=["POST"]),
+        ))
+        _HF_SESSION = session
+    return _HF_SESSION
+
+
+def _extract_summary(data) -> str:
+    # data may be a list of dicts or dict depending on model
+    if isinstance(data, list):
+        # attempt common keys
+        first = data[0]
+        if isinstance(first, dict):
+            return first.get("summary_text") or first.get("generated_text") or str(first)
+        return str(data)
+    if isinstance(data, dict):
+        return data.get("summary_text") or data.get("generated_text") or str(data)
+    return str(data)
+
+
+def _hf_endpoints(model: str) -> List[str]:
+    # primary endpoint first; batched calls only use the primary
+    return [template.format(model=model) for template in HF_ENDPOINTS]
+
+
+def _hf_headers(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+
 def call_hf_inference(model: str, token: str, inputs: str) -> str:
-    # Try multiple HF API endpoints
-    endpoints = [
-        f"https://api-inference.huggingface.co/models/{model}",
-        f"https://router.huggingface.co/models/{model}",
-    ]
-    
-    headers = {"Authorization": f"Bearer {token}"}
+    key = _hf_cache_key(model, inputs)
+    cached = _hf_cache_get(key)
+    if cached is not None:
+        print("Using cached HF response")
+        return cached
+
+    headers = _hf_headers(token)
     payload = {"inputs": inputs}
     
-    for url in endpoints:
+    # Try each HF API endpoint in turn
+    for url in _hf_endpoints(model):
         try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=60)
+            resp = _hf_session().post(url, headers=headers, data=orjson.dumps(payload), timeout=60)
             if resp.status_code == 200:
-                data = resp.json()
-                # data may be a list of dicts or dict depending on model
-                if isinstance(data, list):
-                    # attempt common keys
-                    first = data[0]
-                    if isinstance(first, dict):
-                        return first.get("summary_text") or first.get("generated_text") or str(first)
-                    return str(data)
-                if isinstance(data, dict):
-                    return data.get("summary_text") or data.get("generated_text") or str(data)
-                return str(data)
+                summary = _extract_summary(orjson.loads(resp.content))
+                _hf_cache_put(key, summary)
+                return summary
         except Exception as e:
             print(f"Failed to call {url}: {e}")
             continue
@@ -83,6 +212,79 @@ def call_hf_inference(model: str, token: str, inputs: str) -> str:
     return simple_extractive_summary(inputs)
 
 
+async def _summarize_all(model: str, token: str, inputs_list: List[str]) -> List[str]:
+    """Summarize inputs concurrently, one HF request per input."""
+    # Cap in-flight requests to stay under HF rate limits
+    semaphore = asyncio.Semaphore(4)
+
+    async def _one(inputs: str) -> str:
+        async with semaphore:
+            # requests is blocking; the shared session's pool serves the worker threads
+            return await asyncio.to_thread(call_hf_inference, model, token, inputs)
+
+    results = await asyncio.gather(*[_one(inputs) for inputs in inputs_list],
+                                   return_exceptions=True)
+
+    summaries = []
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Error calling HF inference: {result}")
+            result = ""
+        summaries.append(result)
+    return summaries
+
+
+def _post_hf_batch(url: str, headers: dict, inputs_list: List[str]) -> Optional[list]:
+    """POST inputs as one batch, halving it while the server rejects the size.
+
+    Returns one raw output per input, or None if the model does not batch.
+    """
+    payload = {"inputs": inputs_list, "options": {"use_cache": True, "wait_for_model": True}}
+    resp = _hf_session().post(url, headers=headers, data=orjson.dumps(payload), timeout=120)
+    if resp.status_code in (413, 422) and len(inputs_list) > 1:
+        mid = len(inputs_list) // 2
+        print(f"Batch of {len(inputs_list)} rejected ({resp.status_code}), splitting")
+        left = _post_hf_batch(url, headers, inputs_list[:mid])
+        right = _post_hf_batch(url, headers, inputs_list[mid:]) if left is not None else None
+        return left + right if right is not None else None
+    if resp.status_code != 200:
+        return None
+    data = orjson.loads(resp.content)
+    # Models without batching answer with a single dict; only trust one output per input
+    if isinstance(data, list) and len(data) == len(inputs_list):
+        return data
+    return None
+
+
+async def call_hf_inference_batch(model: str, token: str, inputs_list: List[str]) -> List[str]:
+    """Summarize several inputs with one request, falling back to concurrent per-item calls."""
+    keys = [_hf_cache_key(model, inputs) for inputs in inputs_list]
+    results: List[Optional[str]] = [_hf_cache_get(key) for key in keys]
+    pending = [i for i, cached in enumerate(results) if cached is None]
+    if not pending:
+        return results
+
+    url = _hf_endpoints(model)[0]
+    headers = _hf_headers(token)
+    try:
+        # requests is blocking; run it off the event loop so other stages keep going
+        data = await asyncio.to_thread(_post_hf_batch, url, headers, [inputs_list[i] for i in pending])
+    except Exception as e:
+        print(f"Batched call to {url} failed: {e}")
+        data = None
+
+    if data is not None:
+        for i, item in zip(pending, data):
+            results[i] = _extract_summary(item)
+            _hf_cache_put(keys[i], results[i])
+        return results
+
+    summaries = await _summarize_all(model, token, [inputs_list[i] for i in pending])
+    for i, summary in zip(pending, summaries):
+        results[i] = summary
+    return results
+
+
 def simple_extractive_summary(text: str, num_sentences: int = 3) -> str:
     """Simple extractive summarization by selecting key sentences from content"""
     # Remove any summarization prompts completely
@@ -102,29 +304,21 @@ def simple_extractive_summary(text: str, num_sentences: int = 3) -> str:
             content_lines.append(line)
         text = '\n'.join(content_lines)
     
-    # Clean and extract meaningful sentences
-    sentences = []
-    for line in text.split('\n'):
-        line = line.strip()
-        if line and not line.startswith('http') and len(line) > 10:  # Filter short/URL lines
-            # Split on periods but keep sentences with content
-            parts = [s.strip() for s in line.split('.') if s.strip() and len(s.strip()) > 5]
-            sentences.extend(parts)
-    
-    if not sentences:
-        return "No meaningful content to summarize."
-    
-    # Remove duplicates while preserving order
+    # Single scan for sentences of 16+ chars, deduped case-insensitively in order
     unique_sentences = []
     seen = set()
-    for sentence in sentences:
+    for match in RE_SENTENCE.finditer(text):
+        line_start = text.rfind('\n', 0, match.start()) + 1
+        if RE_URL_LINE.match(text, line_start):
+            continue
+        sentence = match.group(0)
         lower = sentence.lower()
-        if lower not in seen and len(sentence) > 15:  # Filter very short sentences
+        if lower not in seen:
             seen.add(lower)
             unique_sentences.append(sentence)
     
     if not unique_sentences:
-        return "No substantial content found."
+        return "No meaningful content to summarize."
     
     if len(unique_sentences) <= num_sentences:
         return '. '.join(unique_sentences) + '.'
@@ -143,31 +337,107 @@ def simple_extractive_summary(text: str, num_sentences: int = 3) -> str:
     return '. '.join(selected) + '.'
 
 
-async def fetch_messages_text(client: TelegramClient, channel: str, limit: int = 200) -> str:
+def _sender_label(sender) -> str:
+    # Get sender info (username, first name, or ID)
+    if not sender:
+        return "Unknown"
+    username = getattr(sender, "username", None)
+    if username:
+        return f"@{username}"
+    first_name = getattr(sender, "first_name", None)
+    if first_name:
+        last_name = getattr(sender, "last_name", None)
+        return f"{first_name} {last_name}" if last_name else first_name
+    sender_id = getattr(sender, "id", None)
+    return f"User#{sender_id}" if sender_id is not None else "Unknown"
+
+
+async def _fetch_history(client: TelegramClient, entity, limit: int) -> list:
+    """Return the text messages among the limit most recent, oldest first."""
+    if limit <= HISTORY_PAGE_SIZE * 5:
+        # wait_time=0: no pause between Telethon's 100-message requests
+        messages = [msg async for msg in client.iter_messages(entity, limit=limit, wait_time=0) if msg.message]
+        # messages are returned newest->oldest; reverse to chronological
+        messages.reverse()
+        return messages
+
+    # Large ranges: fetch the 100-message pages concurrently and merge them by id.
+    # Every page is anchored just above the newest id seen now, so messages posted
+    # while the pages are in flight cannot shift the offsets
+    latest = await client.get_messages(entity, limit=1)
+    if not latest:
+        return []
+    anchor_id = latest[0].id + 1
+    semaphore = asyncio.Semaphore(4)
+
+    async def _page(offset: int):
+        async with semaphore:
+            return await client.get_messages(entity, limit=min(HISTORY_PAGE_SIZE, limit - offset),
+                                             offset_id=anchor_id, add_offset=offset)
+
+    pages = await asyncio.gather(*[_page(offset) for offset in range(0, limit, HISTORY_PAGE_SIZE)])
+    by_id = {msg.id: msg for page in pages for msg in page if msg.message}
+    return [by_id[msg_id] for msg_id in sorted(by_id)]
+
+
+async def iter_chunks(client: TelegramClient, channel: str, limit: int = 200, max_chars: int = 3000):
+    """Yield chronological chunks of formatted messages, each at most max_chars long."""
     entity = await client.get_entity(channel)
-    messages = []
-    async for msg in client.iter_messages(entity, limit=limit):
-        if msg and getattr(msg, "message", None):
-            # Format: [YYYY-MM-DD HH:MM:SS UTC] @username: message_text
-            timestamp = msg.date.strftime("%Y-%m-%d %H:%M:%S UTC")
-            
-            # Get sender info (username, first name, or ID)
-            sender = "Unknown"
-            if hasattr(msg, 'sender') and msg.sender:
-                if hasattr(msg.sender, 'username') and msg.sender.username:
-                    sender = f"@{msg.sender.username}"
-                elif hasattr(msg.sender, 'first_name') and msg.sender.first_name:
-                    sender = msg.sender.first_name
-                    if hasattr(msg.sender, 'last_name') and msg.sender.last_name:
-                        sender += f" {msg.sender.last_name}"
-                elif hasattr(msg.sender, 'id'):
-                    sender = f"User#{msg.sender.id}"
-            
-            formatted_msg = f"[{timestamp}] {sender}: {msg.message}"
-            messages.append(formatted_msg)
-    # messages are returned newest->oldest; reverse to chronological
-    messages.reverse()
-    return "\n\n".join(messages)
+    history = await _fetch_history(client, entity, limit)
+
+    buf = []
+    buf_len = 0
+    for msg in history:
+        # Format: [YYYY-MM-DD HH:MM:SS UTC] @username: message_text
+        line = f"[{msg.date:%Y-%m-%d %H:%M:%S UTC}] {_sender_label(msg.sender)}: {msg.message}"
+        if buf and buf_len + 2 + len(line) > max_chars:
+            yield "\n\n".join(buf)
+            buf = []
+            buf_len = 0
+        if len(line) > max_chars:
+            # a single oversized message is split at natural boundaries
+            for piece in chunk_text(line, max_chars=max_chars):
+                yield piece
+            continue
+        buf_len += len(line) + (2 if buf else 0)
+        buf.append(line)
+    if buf:
+        yield "\n\n".join(buf)
+
+
+@lru_cache(maxsize=1)
+def _local_pipeline(model: str):
+    # Built once per run; transformers and torch are only needed for --local
+    import torch
+    from transformers import pipeline
+
+    # An explicit device index avoids device_map, which would also require accelerate
+    if torch.cuda.is_available():
+        dtype, device = torch.float16, 0
+    else:
+        dtype, device = torch.bfloat16, -1
+        torch.set_num_threads(os.cpu_count() or 1)
+    return pipeline("summarization", model=model, torch_dtype=dtype, device=device)
+
+
+def summarize_locally(model: str, inputs_list: List[str]) -> List[str]:
+    """Summarize inputs with a local transformers pipeline, batched internally."""
+    pipe = _local_pipeline(model)
+    results = pipe(inputs_list, batch_size=8, max_length=256, truncation=True)
+    return [r["summary_text"] for r in results]
+
+
+async def reduce_summaries(summarize, summaries: List[str]) -> str:
+    """Merge summaries pairwise, one batched summarize() call per tree level."""
+    while len(summaries) > 1:
+        pairs = [f"{a}\n\n{b}" for a, b in zip(summaries[::2], summaries[1::2])]
+        print(f"Reducing {len(summaries)} summaries -> {len(pairs) + len(summaries) % 2}")
+        prompts = [f"Summarize these summaries into a single concise summary:\n\n{p}" for p in pairs]
+        merged = await summarize(prompts)
+        # keep the unmerged text if a pair could not be summarized
+        merged = [m or p for m, p in zip(merged, pairs)]
+        summaries = merged + ([summaries[-1]] if len(summaries) % 2 else [])
+    return summaries[0]
 
 
 async def main():
@@ -175,8 +445,10 @@ async def main():
     parser.add_argument("--channel", required=True, help="channel username or id (e.g. @mychannel)")
     parser.add_argument("--limit", type=int, default=200, help="number of recent messages to fetch")
     parser.add_argument("--model", default=os.getenv("HF_MODEL", "facebook/bart-large-cnn"))
-    parser.add_argument("--out", default=None, help="optional output file to write summary")
+    parser.add_argument("--out", default=None, help="optional output file to write summary (zstd-compressed if it ends in .zst)")
     parser.add_argument("--raw", default=None, help="optional file to save raw extracted messages")
+    parser.add_argument("--local", action="store_true",
+                        help="summarize with a local transformers pipeline instead of the HF Inference API")
     args = parser.parse_args()
 
     api_id = os.getenv("TELEGRAM_API_ID")
@@ -189,7 +461,7 @@ async def main():
 
     if not api_id or not api_hash:
         raise SystemExit("TELEGRAM_API_ID and TELEGRAM_API_HASH must be set in the environment or .env")
-    if not hf_token:
+    if not hf_token and not args.local:
         raise SystemExit("HF_TOKEN (Hugging Face token with read/inference scope) must be set")
 
     # Telethon expects int api_id
@@ -212,59 +484,68 @@ async def main():
             print(f"\nNo session file found ({session_file}). Creating new user session...")
             print("You will be prompted for your phone number and verification code.")
 
+    from telethon import TelegramClient
+
     client = TelegramClient(session_name, api_id, api_hash)
     await client.start(bot_token=bot_token)  # if bot_token is None, will do user login flow
 
     print(f"Fetching last {args.limit} messages from {args.channel}...")
-    text = await fetch_messages_text(client, args.channel, limit=args.limit)
-    if not text.strip():
+    # messages are packed into chunks as they are formatted, never joined into one string
+    chunks = [chunk async for chunk in iter_chunks(client, args.channel, limit=args.limit, max_chars=3000)]
+    # Telegram is not needed past this point; disconnect while summarizing
+    disconnecting = asyncio.ensure_future(client.disconnect())
+    if not chunks:
         print("No text messages found.")
-        await client.disconnect()
+        await disconnecting
         return
 
+    # summarize each chunk, then combine
+    print(f"Text length: {sum(map(len, chunks))} chars -> {len(chunks)} chunk(s)")
+
+    if args.local:
+        async def summarize(prompts: List[str]) -> List[str]:
+            return await asyncio.to_thread(summarize_locally, args.model, prompts)
+    else:
+        async def summarize(prompts: List[str]) -> List[str]:
+            return await call_hf_inference_batch(args.model, hf_token, prompts)
+
+    print(f"Summarizing {len(chunks)} chunk(s) in one batched request")
+    prompts = [f"Summarize the following chat messages in a few concise bullet points:\n\n{c}" for c in chunks]
+    # Start inference first; yielding once lets the worker thread start so the raw dump overlaps it
+    summarizing = asyncio.ensure_future(summarize(prompts))
+    await asyncio.sleep(0)
+
     # Save raw messages if requested
     if args.raw:
         with open(args.raw, "w", encoding="utf-8") as f:
-            f.write(text)
+            for i, c in enumerate(chunks):
+                if i:
+                    f.write("\n\n")
+                f.write(c)
         print(f"Saved raw messages to {args.raw}")
 
-    # chunk and summarize each chunk, then combine
-    chunks = chunk_text(text, max_chars=3000)
-    print(f"Text length: {len(text)} chars -> {len(chunks)} chunk(s)")
-
-    summaries = []
-    for i, c in enumerate(chunks, start=1):
-        print(f"Summarizing chunk {i}/{len(chunks)} (approx {len(c)} chars)")
-        prompt = f"Summarize the following chat messages in a few concise bullet points:\n\n{c}"
-        try:
-            summary = call_hf_inference(args.model, hf_token, prompt)
-        except Exception as e:
-            print(f"Error calling HF inference: {e}")
-            summary = ""
-        summaries.append(summary)
+    summaries = await summarizing
 
-    combined = "\n\n".join(summaries)
     # optional final summarize pass if there were multiple chunks
     if len(summaries) > 1:
         print("Creating final combined summary...")
-        final_prompt = "Summarize these summaries into a single concise summary:\n\n" + combined
-        try:
-            final_summary = call_hf_inference(args.model, hf_token, final_prompt)
-        except Exception as e:
-            print(f"Final summarization failed: {e}")
-            final_summary = combined
+        final_summary = await reduce_summaries(summarize, summaries)
     else:
-        final_summary = combined
+        final_summary = summaries[0]
 
     if args.out:
-        with open(args.out, "w", encoding="utf-8") as f:
-            f.write(final_summary)
+        if args.out.endswith(".zst"):
+            with open(args.out, "wb") as f:
+                f.write(_ZSTD_C.compress(final_summary.encode("utf-8")))
+        else:
+            with open(args.out, "w", encoding="utf-8") as f:
+                f.write(final_summary)
         print(f"Saved summary to {args.out}")
     else:
         print('\n' + '=' * 40 + '\nFINAL SUMMARY:\n' + '=' * 40 + '\n')
         print(final_summary)
 
-    await client.disconnect()
+    await disconnecting
 
 
 if __name__ == "__main__":